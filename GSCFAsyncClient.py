@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+#Copyright 2013 Enrico Giampieri <enrico.giampieri@unibo.it>
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+"""
+An asynchronous version of the GSCFClient Session, where all the API calls
+are coroutines, so that many of them can run at the same time on the same event loop.
+
+Requires python 3.7 and above and the aiohttp library,
+the GSCFClient module should be in the same directory
+
+>>> import asyncio
+>>> from GSCFAsyncClient import AsyncSession
+
+>>> async def load(user, passwd, api_key):
+...     async with AsyncSession(user, passwd, api_key) as session:
+...         studies = await session.getStudies()
+...         # all the calls are sent concurrently
+...         return await asyncio.gather(*[session.getSubjectsForStudy(token)
+...                                       for token in studies.index])
+
+>>> subjects = asyncio.get_event_loop().run_until_complete(load(user, passwd, api_key))
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from GSCFClient import Session, _json, _FORM_HEADERS
+
+class AsyncSession(Session):
+    """Same as Session, but the API calls are coroutines
+    the authentication is still done when the session is created,
+    the following ones (when the token expires) are done asynchronously.
+    Errors of the server raise the aiohttp ClientResponseError
+    """
+    def __init__(self, *args, **kwargs):
+        """same arguments of Session, max_workers is not used"""
+        #writes the token file out of the event loop, one write at a time
+        #(created when needed, like the aiohttp session)
+        self._writer = None
+        self._save_pending = False
+        #created when the first call is done, inside the event loop
+        self._client = None
+        super(AsyncSession, self).__init__(*args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """close the connections to the server and wait for the token to be saved
+        the session can still be used afterwards, opening them again"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            await asyncio.get_running_loop().run_in_executor(None, writer.shutdown)
+        #used by the first authentication
+        self._http.close()
+
+    def _get_client(self):
+        """return the aiohttp session, creating it the first time"""
+        if self._client is None:
+            self._client = aiohttp.ClientSession()
+        return self._client
+
+    async def _authenticate(self):
+        """same as authenticate, without blocking the event loop"""
+        async with self._get_client().post(self.baseURL+"authenticate", data=self._base_qargs,
+                                           headers={"Authorization": self._auth_header}) as response:
+            response.raise_for_status()
+            result = _json.loads(await response.read())
+        self._set_token(result['token'], result['sequence'])
+        self._from_disk = False
+        self._save_token()
+
+    def _save_token(self):
+        """same as Session._save_token, but inside the event loop the file is written
+        by a separate thread. The writes not started yet are merged in one,
+        as each of them saves the last sequence"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            #the first authentication, when the session is created
+            return Session._save_token(self)
+        if not self._save_pending:
+            self._save_pending = True
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1)
+            loop.run_in_executor(self._writer, self._write_token)
+
+    def _write_token(self):
+        """save the token from the writer thread"""
+        self._save_pending = False
+        Session._save_token(self)
+
+    async def _do_request(self, action, query_args):
+        """send a request to the api and return the raw JSON answer"""
+        async with self._get_client().post(self.baseURL+action, data=query_args,
+                                     headers=_FORM_HEADERS) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def _call_raw(self, action, options={}, retry=True):
+        """same as __call__, but return the raw JSON answer instead of the decoded object
+        if the server refuses a token saved by a previous session (401 - not authorized)
+        authenticate again and retry once"""
+        key = self._cache_key(action, options)
+        raw = self._cached(key)
+        if raw is None:
+            #the sequence is reserved before the first await,
+            #so the calls take their numbers in the order they are created
+            validation, = self._reserve_sequences(1)
+            try:
+                raw = await self._do_request(action, self._query_args(validation, options))
+            except aiohttp.ClientResponseError as error:
+                if not retry or not self._from_disk or error.status != 401:
+                    raise
+                #the token saved by a previous session may have expired
+                await self._authenticate()
+                return await self._call_raw(action, options, retry=False)
+            self._store(key, raw)
+        return raw
+
+    async def __call__(self, action, options={}):
+        """Call the GSCF api with the specified action (as a string) and the corresponding options
+        it's a low level call that return a JSON object, so should not be used by the user directly"""
+        return _json.loads(await self._call_raw(action, options))
+
+    async def _fetch_many(self, action, key, tokens, result_field):
+        """call the action once for each token (given as the option key) and return
+        the list of the result_field of each answer, in the same order of the tokens.
+        If the server refuses the concurrent calls (401) authenticate again and retry once"""
+        missing = [token for token in tokens if self._cached(self._cache_key(action, {key:token})) is None]
+        if not self._concurrent or len(missing) <= 1:
+            raws = [await self._call_raw(action, {key:token}) for token in tokens]
+            return [_json.loads(raw)[result_field] for raw in raws]
+        raws = await asyncio.gather(*[self._call_raw(action, {key:token}, retry=False) for token in tokens],
+                                    return_exceptions=True)
+        errors = [raw for raw in raws if isinstance(raw, Exception)]
+        if errors:
+            if not all(isinstance(error, aiohttp.ClientResponseError) and error.status == 401
+                       for error in errors):
+                raise errors[0]
+            #the token saved by a previous session may have expired,
+            #or the server can refuse the calls arriving out of order (see Session._fetch_many)
+            expired = self._from_disk
+            await self._authenticate()
+            #retry once from the new sequence, one call at a time,
+            #and keep doing so if this solves the problem and the token was not just expired
+            previous, self._concurrent = self._concurrent, False
+            try:
+                raws = [await self._call_raw(action, {key:token}, retry=False) for token in tokens]
+            except aiohttp.ClientResponseError:
+                self._concurrent = previous
+                raise
+            if expired:
+                self._concurrent = previous
+        return [_json.loads(raw)[result_field] for raw in raws]
+
+    async def _multi(self, action, key, tokens, result_field):
+        """same as _fetch_many, but send the tokens in comma separated groups of batch_size
+        (see Session._multi)"""
+        if self.batch_size > 1 and self._batch_supported and len(tokens) > 1:
+            groups = [','.join(tokens[idx:idx+self.batch_size]) for idx in range(0, len(tokens), self.batch_size)]
+            try:
+                return await self._fetch_many(action, key, groups, result_field)
+            except aiohttp.ClientResponseError as error:
+                if error.status != 400:
+                    raise
+                self._batch_supported = False
+        return await self._fetch_many(action, key, tokens, result_field)
+
+    async def getStudies(self, columns=None):
+        """return all the studies that can be seen by the user
+        not all of these can be read (Samples and measurements can be private)
+        if columns is given the dataframe will contain only those columns"""
+        res = (await self("getStudies"))['studies']
+        if self.dataframe:
+            res = self._frame(res, columns)
+        return res
+
+    async def getSubjectsForStudy(self, *study_token):
+        """take all the subjects from a study given the study token
+        if multiple token are given it will merge all the results"""
+        return self._merge_records(await self._multi('getSubjectsForStudy', 'studyToken', study_token, 'subjects'))
+
+    async def getAssaysForStudy(self, *study_token):
+        """take all the assays from a study given the study token
+        if multiple token are given it will merge all the results"""
+        return self._merge_records(await self._multi('getAssaysForStudy', 'studyToken', study_token, 'assays'))
+
+    async def getSamplesForAssay(self, *assay_token):
+        """take all the samples from an assay given the assay token
+        if multiple token are given it will merge all the results"""
+        return self._merge_records(await self._multi('getSamplesForAssay', 'assayToken', assay_token, 'samples'))
+
+    async def getMeasurementDataForAssay(self, *assay_token):
+        """take all the measurements from an assay given the assay token
+        if multiple token are given it will merge all the results"""
+        return self._merge_measurements(await self._multi('getMeasurementDataForAssay', 'assayToken', assay_token, 'measurements'))
@@ -22,8 +22,8 @@ A python Client for connecting to the GSCF database
 using the API as described in:
    http://old.studies.dbnp.org/api/
 
-Is implemented in pure python (version 2.6 and above), and leverage
-the pandas library for data analysis if installed
+Is implemented in pure python (version 2.6 and above) on top of the
+requests library, and leverage the pandas library for data analysis if installed
 
 see also
     https://github.com/PhenotypeFoundation/
@@ -40,6 +40,10 @@ see also
 
 >>> # connect to the old database (with the same API)
 >>> session = Session(user,passwd,api_key, baseurl="http://old.studies.dbnp.org/api/")
+
+>>> # the authentication token is saved in ~/.gscf_cache and reused by the next sessions,
+>>> # set token_cache to None to authenticate each time
+>>> session = Session(user,passwd,api_key, token_cache=None)
 >>> studies = session.getStudies()
 
 >>> print "found {} studies".format(len(studies))
@@ -47,6 +51,11 @@ see also
 >>> # choose the studies that contains PPS in the title
 >>> # and load the subjects of the first study
 >>> tokens = studies.index[studies['title'].str.contains('PPS')]
+
+>>> # load only the columns you need, or set lazy to True to build
+>>> # the dataframes only when they are used
+>>> titles = session.getStudies(columns=['title'])
+>>> session = Session(user,passwd,api_key, lazy=True)
 >>> subjects = session.getSubjectsForStudy(tokens[0])
 
 >>> # to load the subjects of multiple studies at the same time
@@ -66,35 +75,240 @@ see also
 >>> assay_token = assays.index[0]
 >>> samples = session.getSamplesForAssay(assay_token)
 >>> measures = session.getMeasurementDataForAssay(assay_token)
+
+>>> # the answers are kept in memory for a minute (see the cache_ttl option)
+>>> # to read again the data from the server forget them
+>>> session.invalidate()
 """
 
-import md5
-import urllib
-import urllib2
+import os
+import hashlib
 import base64
-import json
+import tempfile
+import threading
+import time
+import itertools
+from collections import OrderedDict
+try:
+    from sys import intern
+except ImportError:
+    #python 2, intern is a builtin
+    pass
 from uuid import getnode as get_mac
-from contextlib import closing
+from io import BytesIO
+try:
+    from urllib import urlencode, quote_plus
+except ImportError:
+    #python 3
+    from urllib.parse import urlencode, quote_plus
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+#use the fastest JSON decoder available, the answers can be quite big
+try:
+    import orjson as _json
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
+#the big answers can be decoded while they are downloaded, if ijson is installed
+#(at least version 3.1, for kvitems with use_float)
+try:
+    import ijson
+    list(ijson.kvitems(BytesIO(b'{}'), '', use_float=True))
+except (ImportError, AttributeError, TypeError):
+    ijson = None
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    #python 2 without the futures backport: the calls will be done one after the other
+    ThreadPoolExecutor = None
+
+def _to_bytes(text):
+    """encode the text in utf-8, unless it's already a byte string"""
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+try:
+    _string_types = basestring
+except NameError:
+    #python 3
+    _string_types = str
+
+#the requests bodies are encoded by the session, so their type must be given explicitly
+_FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+#replace the file atomically (os.replace is missing in python 2, where rename does it on posix)
+_replace = getattr(os, 'replace', os.rename)
+
+def _interned(record):
+    """return a copy of the record with the keys interned, so that all the records
+    share the same key strings (the JSON decoders do so, but ijson doesn't)
+    only the str keys are interned: python 2 can't intern the unicode ones"""
+    return dict((intern(name) if isinstance(name, str) else name, value)
+                for name, value in record.items())
+
+def _columns(records):
+    """transpose a list of records (dictionaries) in a dictionary of columns
+    return None if the records don't have all the same keys"""
+    if not records:
+        return None
+    names = list(records[0])
+    width = len(names)
+    if any(len(record) != width for record in records):
+        return None
+    try:
+        return names, dict((name, [record[name] for record in records]) for name in names)
+    except KeyError:
+        return None
+
+def _retry_policy():
+    """retry the calls that fail for a transient error of the server
+    only 503 (service unavailable) is retried: with 502 and 504 the server may have handled
+    the call already, and resending its validation key would reuse a sequence number
+    (the name of the option for retrying the POST changed between the urllib3 versions)"""
+    options = dict(total=3, read=False, backoff_factor=0.3,
+                   status_forcelist=(503,), raise_on_status=False)
+    try:
+        return Retry(allowed_methods=None, **options)
+    except TypeError:
+        return Retry(method_whitelist=False, **options)
+
+class LazyDF(object):
+    """Wrap the records loaded from the server and convert them to a dataframe
+    only the first time it's used as a dataframe. The length, the index and the
+    single columns are built directly from the records, without the whole dataframe.
+    Everything else (attributes, assignments, comparison and arithmetic operators)
+    is done on the dataframe, building it first
+    """
+    def __init__(self, session, data):
+        self._session = session
+        self._data = data
+        self._df = None
+        self._index = None
+
+    def _build(self):
+        """return the dataframe, building it if needed"""
+        if self._df is None:
+            self._df = self._session.to_dataframe(self._data)
+            self._data = None
+        return self._df
+
+    @property
+    def index(self):
+        if self._df is not None:
+            return self._df.index
+        if self._index is None:
+            self._index = self._session.pandas.Index([record['token'] for record in self._data], name='token')
+        return self._index
+
+    def __getitem__(self, key):
+        #a column missing from some records goes to the dataframe,
+        #that fills it with NaN (or raises the KeyError if it's missing from all)
+        if (self._df is None and isinstance(key, _string_types) and key != 'token'
+                and self._data and all(key in record for record in self._data)):
+            values = [record[key] for record in self._data]
+            return self._session.pandas.Series(values, index=self.index, name=key)
+        return self._build()[key]
+
+    def __setitem__(self, key, value):
+        self._build()[key] = value
+
+    def __getattr__(self, name):
+        #avoid looping when the object is not initialized yet (e.g. while copying it)
+        if name in ('_session', '_data', '_df', '_index'):
+            raise AttributeError(name)
+        return getattr(self._build(), name)
+
+    def __len__(self):
+        return len(self._data) if self._df is None else len(self._df)
+
+    def __iter__(self):
+        return iter(self._build())
+
+    def __contains__(self, key):
+        return key in self._build()
+
+    def __repr__(self):
+        return repr(self._build())
+
+def _delegate(name):
+    """return a method that calls the one with the same name of the dataframe
+    the operators are looked up on the class, so __getattr__ doesn't see them"""
+    def method(self, *args, **kwargs):
+        args = [arg._build() if isinstance(arg, LazyDF) else arg for arg in args]
+        return getattr(self._build(), name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+for _name in ('__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+              '__add__', '__sub__', '__mul__', '__truediv__', '__floordiv__', '__mod__', '__pow__',
+              '__radd__', '__rsub__', '__rmul__', '__rtruediv__', '__rfloordiv__', '__rmod__', '__rpow__',
+              '__and__', '__or__', '__xor__', '__neg__', '__pos__', '__abs__', '__invert__',
+              '__div__', '__rdiv__', '__array__'):
+    setattr(LazyDF, _name, _delegate(_name))
+#a dataframe can't be hashed either
+LazyDF.__hash__ = None
 
 class Session(object):
     """Instances of this class represents connections to the database GSCF
-    it don't do any form of error chacking, as the urllib module raise a clear HTTPError
+    it don't do any form of error chacking, as the requests library raise a clear HTTPError
     if something goes wrong
     """
-    def __init__(self, username, password, api_key, baseurl="http://studies.dbnp.org/api/", dataframe=True):
-        """initialize the Session with the authentication credential on the given url"""
+    #the streamed answers (see _do_request) bigger than this are decoded while downloading
+    #the size is the one sent by the server, so it's compressed if the answer is
+    stream_threshold = 1024*1024
+
+    def __init__(self, username, password, api_key, baseurl="http://studies.dbnp.org/api/", dataframe=True, max_workers=8, batch_size=1, cache_ttl=60, cache_size=128, token_cache="~/.gscf_cache", lazy=False):
+        """initialize the Session with the authentication credential on the given url
+        max_workers is the number of concurrent calls used when loading multiple tokens
+        batch_size is the number of tokens sent in each call (comma separated),
+        use it only if the server accepts multiple tokens at once
+        cache_ttl is the number of seconds the answers are kept in memory (0 to disable)
+        cache_size is the maximum number of answers kept, the least recently used are dropped
+        token_cache is the directory where the token is saved for the next sessions (None to disable)
+        with lazy the dataframes are built only when used (see LazyDF)"""
         #save the basic data
         self.user = username
         self.passwd = password
         self.apikey = api_key
         self.baseURL = baseurl
         self.dataframe = dataframe
+        self.lazy = lazy
+        self.max_workers = max_workers
+        #become False if the server refuses the calls arriving out of order
+        self._concurrent = True
+        self.batch_size = batch_size
+        #become False if the server refuses the comma separated tokens
+        self._batch_supported = True
+        #the answers already received, as (action, options) -> (time, raw answer)
+        #from the least to the most recently used
+        self._cache = OrderedDict()
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        #the sequence and the cache are shared between the threads of the concurrent calls
+        self._lock = threading.Lock()
+        self._token_cache = None if token_cache is None else os.path.expanduser(token_cache)
+        #keep the connections to the server alive between the calls
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=_retry_policy())
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+        #the JSON answers are very repetitive and compress well,
+        #requests decompress them transparently (also the streamed ones)
+        self._http.headers['Accept-Encoding'] = 'gzip, deflate'
         #create the deviceID using the device mac address, a fixed string and the username
         base_string = 'GSCF database Python API'
-        md5digest=md5.md5(str(get_mac())+base_string+username)
+        md5digest=hashlib.md5(_to_bytes(str(get_mac())+base_string+username))
         self.deviceID = md5digest.hexdigest()
-        #authenticate thyself to the server...do not really need a separate function
-        self.authenticate()
+        #the parts of the requests that never change
+        credentials = _to_bytes(self.user) + b':' + _to_bytes(self.passwd)
+        self._auth_header = "Basic " + base64.b64encode(credentials).decode('ascii')
+        self._base_qargs = {"deviceID":self.deviceID}
+        self._device_qs = "deviceID=" + quote_plus(self.deviceID)
+        #authenticate thyself to the server, unless a previous session left a token
+        if not self._load_token():
+            self.authenticate()
         #try to load the pandas library for returning a DataFrame instead of
         #the JSON object. If pandas is not installed it will raise an ImportError
         if dataframe:
@@ -107,90 +321,319 @@ class Session(object):
     def authenticate(self):
         """make the authentication to the server
         raise HTTPError if something goes wrong"""
-        req = urllib2.Request(self.baseURL+"authenticate")
-        base64string = base64.encodestring('{}:{}'.format(self.user, self.passwd))[:-1]
-        req.add_header("Authorization", "Basic {:s}".format(base64string))
-        req.add_data("deviceID="+self.deviceID)
-        #using a context manager to assure the closure of the resource
-        with closing(urllib2.urlopen(req)) as handle:
-            result = json.loads(handle.read())
-            #save the results in self
-            self.sequence = result['sequence']
-            self.token = result['token']
+        response = self._http.post(self.baseURL+"authenticate", data=self._base_qargs,
+                                   headers={"Authorization": self._auth_header})
+        response.raise_for_status()
+        result = _json.loads(response.content)
+        #save the results in self
+        self._set_token(result['token'], result['sequence'])
+        self._from_disk = False
+        self._save_token()
 
-    def __call__(self,action,options={}):
-        """Call the GSCF api with the specified action (as a string) and the corresponding options
-        it's a low level call that return a JSON object, so should not be used by the user directly"""
+    def _set_token(self, token, sequence):
+        """use the given token and sequence for the next calls"""
+        self.sequence = sequence
+        self.token = token
+        #the validation keys all start with the token and end with the api key,
+        #so the hash of the token is computed once and copied for each call
+        self._md5_token_prefix = hashlib.md5(_to_bytes(self.token))
+        self._apikey_bytes = _to_bytes(self.apikey)
+
+    def _token_path(self):
+        """return the file where the token of this user on this server is saved"""
+        name = hashlib.md5(_to_bytes(self.user + self.baseURL)).hexdigest()
+        return os.path.join(self._token_cache, name + '.json')
+
+    def _load_token(self):
+        """use the token saved by a previous session, return False if there is none"""
+        if self._token_cache is None:
+            return False
+        try:
+            with open(self._token_path(), 'rb') as handle:
+                saved = _json.loads(handle.read())
+            self._set_token(saved['token'], saved['sequence'])
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        #it may have expired since then
+        self._from_disk = True
+        return True
+
+    def _save_token(self):
+        """save the token and the sequence, so that the next sessions can use them
+        the file is readable only by the user and it's replaced atomically"""
+        if self._token_cache is None:
+            return
+        with self._lock:
+            saved = {'token':self.token, 'sequence':self.sequence}
+        try:
+            if not os.path.isdir(self._token_cache):
+                os.makedirs(self._token_cache, 0o700)
+            handle, temp_path = tempfile.mkstemp(dir=self._token_cache)
+            try:
+                with os.fdopen(handle, 'wb') as temp_file:
+                    temp_file.write(_to_bytes(_json.dumps(saved)))
+                _replace(temp_path, self._token_path())
+            except (IOError, OSError):
+                #don't leave the half written file behind
+                os.remove(temp_path)
+                raise
+        except (IOError, OSError):
+            #it's only needed to save time at the next start
+            pass
+
+    def _reserve_sequences(self, n):
+        """reserve the next n sequence numbers and return their validation keys
+        the sequence is incremented atomically, so the keys can be used from multiple threads"""
         #need to increment the sequence call each time
         #to keep the sincrony with the server
-        self.sequence+=1
-        #create the new validation key
-        validate_md5 = md5.md5( self.token + str(self.sequence) + self.apikey )
-        validation = validate_md5.hexdigest()
-        #create the request
-        req = urllib2.Request(self.baseURL+action)
-        query_args = {"deviceID":self.deviceID, "validation":validation}
-        query_args.update(options)
-        req.add_data(urllib.urlencode(query_args))
-        #obtain the results
-        #using a context manager to assure the closure of the resource
-        with closing(urllib2.urlopen(req)) as handle:
-            res = json.loads(handle.read())
-            return res
-
-    def to_dataframe(self,data):
+        with self._lock:
+            first = self.sequence + 1
+            self.sequence += n
+        #the saved sequence must follow the one of the server
+        if n:
+            self._save_token()
+        #create the new validation keys
+        return [self._validation(seq) for seq in range(first, first+n)]
+
+    def _validation(self, sequence):
+        """return the validation key of the call with the given sequence number"""
+        validate_md5 = self._md5_token_prefix.copy()
+        validate_md5.update(str(sequence).encode('ascii'))
+        validate_md5.update(self._apikey_bytes)
+        return validate_md5.hexdigest()
+
+    def _query_args(self, validation, options):
+        """create the (urlencoded) body of a request with the given validation key and options
+        the values of the options can also be lists, that are sent as repeated keys"""
+        body = self._device_qs + "&validation=" + validation
+        if options:
+            body += "&" + urlencode(options, doseq=True)
+        return body
+
+    def _do_request(self, action, query_args, stream_field=None):
+        """send a request to the api and return the raw JSON answer
+        if stream_field is given, ijson is installed and the answer is bigger than stream_threshold,
+        return instead the (key, value) pairs of that field, decoded while downloading them.
+        it doesn't modify the session, so it can be called from multiple threads"""
+        stream = stream_field is not None and ijson is not None
+        response = self._http.post(self.baseURL+action, data=query_args,
+                                   headers=_FORM_HEADERS, stream=stream)
+        try:
+            response.raise_for_status()
+            if stream and int(response.headers.get('Content-Length', 0)) > self.stream_threshold:
+                response.raw.decode_content = True
+                return [(token, _interned(row)) for token, row
+                        in ijson.kvitems(response.raw, stream_field, use_float=True)]
+            return response.content
+        finally:
+            response.close()
+
+    def _cache_key(self, action, options):
+        """return the key of the cache for the given action and options"""
+        return (action, tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                                     for name, value in options.items())))
+
+    def _cached(self, key):
+        """return the raw answer saved in the cache, None if missing or expired
+        the expired answers are removed from the cache"""
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None or time.time() - entry[0] > self._cache_ttl:
+                return None
+            #put it back as the most recently used
+            self._cache[key] = entry
+        return entry[1]
+
+    def _store(self, key, raw):
+        """save a raw answer in the cache (the streamed answers are not saved)
+        dropping the least recently used ones if there are more than cache_size"""
+        if self._cache_ttl > 0 and self._cache_size > 0 and isinstance(raw, bytes):
+            with self._lock:
+                self._cache.pop(key, None)
+                self._cache[key] = (time.time(), raw)
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+    def invalidate(self):
+        """forget all the answers saved in the cache, so that the next calls
+        will read again the data from the server"""
+        with self._lock:
+            self._cache.clear()
+
+    def _call_raw(self, action, options={}, retry=True):
+        """same as __call__, but return the raw JSON answer instead of the decoded object
+        if the server refuses a token saved by a previous session (401 - not authorized)
+        authenticate again and retry once"""
+        key = self._cache_key(action, options)
+        raw = self._cached(key)
+        if raw is None:
+            validation, = self._reserve_sequences(1)
+            try:
+                raw = self._do_request(action, self._query_args(validation, options))
+            except requests.HTTPError as error:
+                if (not retry or not self._from_disk
+                        or error.response is None or error.response.status_code != 401):
+                    raise
+                #the token saved by a previous session may have expired
+                self.authenticate()
+                return self._call_raw(action, options, retry=False)
+            self._store(key, raw)
+        return raw
+
+    def __call__(self,action,options={}):
+        """Call the GSCF api with the specified action (as a string) and the corresponding options
+        it's a low level call that return a JSON object, so should not be used by the user directly
+        the values of the options can also be lists, that are sent as repeated keys
+        the answers are kept in memory for cache_ttl seconds"""
+        #the cache keeps the raw answer, so each call returns a new object
+        return _json.loads(self._call_raw(action, options))
+
+    def _fetch_many(self, action, key, tokens, result_field, stream=False, retry=True):
+        """call the action once for each token (given as the option key) and return
+        the list of the result_field of each answer, in the same order of the tokens.
+        The calls are independent, so they are sent concurrently.
+        With stream the big answers give the (key, value) pairs of the result_field.
+        If the server refuses them (401) and the token was saved by a previous session
+        authenticate again and retry; if the calls were concurrent, retry one call at a time"""
+        stream_field = result_field if stream else None
+        cache_keys = [self._cache_key(action, {key:token}) for token in tokens]
+        raws = [self._cached(cache_key) for cache_key in cache_keys]
+        missing = [idx for idx, raw in enumerate(raws) if raw is None]
+        #all the sequence numbers are reserved at once, so the workers don't need the lock
+        validations = self._reserve_sequences(len(missing))
+        all_args = [self._query_args(validation, {key:tokens[idx]}) for validation, idx in zip(validations, missing)]
+        def fetch(idx, query_args):
+            raws[idx] = self._do_request(action, query_args, stream_field)
+            self._store(cache_keys[idx], raws[idx])
+        concurrent = (ThreadPoolExecutor is not None and self._concurrent
+                      and self.max_workers > 1 and len(all_args) > 1)
+        try:
+            if not concurrent:
+                for idx, query_args in zip(missing, all_args):
+                    fetch(idx, query_args)
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(all_args))) as executor:
+                    futures = [executor.submit(fetch, idx, query_args) for idx, query_args in zip(missing, all_args)]
+                    for future in as_completed(futures):
+                        future.result()
+        except requests.HTTPError as error:
+            if not retry or error.response is None or error.response.status_code != 401:
+                raise
+            #the token saved by a previous session may have expired,
+            #a single call with a fresh token is refused because the data can't be read
+            expired = self._from_disk
+            if not expired and not concurrent:
+                raise
+            #the server can refuse the calls arriving out of order: start again from a new sequence
+            #sending one call at a time, and keep doing so if this solves the problem
+            #(an expired token doesn't tell anything about the order of the calls)
+            self.authenticate()
+            previous, self._concurrent = self._concurrent, False
+            try:
+                raws = self._fetch_many(action, key, tokens, result_field, stream, retry=False)
+            except requests.HTTPError:
+                self._concurrent = previous
+                raise
+            if expired:
+                self._concurrent = previous
+            return raws
+        return [_json.loads(raw)[result_field] if isinstance(raw, bytes) else raw for raw in raws]
+
+    def _multi(self, action, key, tokens, result_field, stream=False):
+        """same as _fetch_many, but send the tokens in comma separated groups of batch_size
+        to save round-trips. If the server refuses them (400 - bad request) the tokens
+        are sent one by one, and the groups are not used anymore by this session"""
+        if self.batch_size > 1 and self._batch_supported and len(tokens) > 1:
+            groups = [','.join(tokens[idx:idx+self.batch_size]) for idx in range(0, len(tokens), self.batch_size)]
+            try:
+                return self._fetch_many(action, key, groups, result_field, stream)
+            except requests.HTTPError as error:
+                if error.response is None or error.response.status_code != 400:
+                    raise
+                self._batch_supported = False
+        return self._fetch_many(action, key, tokens, result_field, stream)
+
+    def to_dataframe(self,data,columns=None):
         """convert the given object to a pandas dataframe
+        if columns is given only those columns are built
         utility function, only for internal use"""
-        return self.pandas.DataFrame(data).set_index('token')
+        if columns is not None:
+            for name in columns:
+                if not any(name in record for record in data):
+                    raise KeyError(name)
+            index = self.pandas.Index([record['token'] for record in data], name='token')
+            #the missing values are NaN, as in the whole dataframe
+            values = dict((name, [record.get(name, float('nan')) for record in data]) for name in columns)
+            return self.pandas.DataFrame(values, index=index, columns=columns)
+        #the records usually have all the same keys, so they are transposed
+        #in one list for each column, without unpacking them one by one
+        transposed = _columns(data)
+        if transposed is None or 'token' not in transposed[1]:
+            return self.pandas.DataFrame.from_records(data, index='token')
+        names, columns = transposed
+        index = self.pandas.Index(columns.pop('token'), name='token')
+        return self.pandas.DataFrame(columns, index=index, columns=[name for name in names if name != 'token'])
 
-    def getStudies(self):
+    def _frame(self, data, columns=None):
+        """convert the records to a dataframe, or wrap them in a LazyDF if the session is lazy"""
+        if self.lazy and columns is None:
+            return LazyDF(self, data)
+        return self.to_dataframe(data, columns)
+
+    def _merge_records(self, chunks):
+        """merge the lists of records loaded for each token
+        and convert them to a dataframe if required"""
+        res = list(itertools.chain.from_iterable(chunks))
+        if self.dataframe: 
+            res = self._frame(res)
+        return res
+
+    def _merge_measurements(self, chunks):
+        """merge the measurements loaded for each token
+        and convert them to a dataframe if required"""
+        #the measurements are given as a dictionary indexed by the token
+        #(or as the list of its items, if the answer was streamed)
+        res = {}
+        for chunk in chunks:
+            res.update(chunk)
+        if self.dataframe:
+            #the measurement data has a format different from the others,
+            #the tokens are the keys of the dictionary
+            transposed = _columns(list(res.values()))
+            if transposed is None:
+                res = self.pandas.DataFrame.from_dict(res, orient='index')
+                res.index.name = 'token'
+            else:
+                names, columns = transposed
+                index = self.pandas.Index(list(res), name='token')
+                res = self.pandas.DataFrame(columns, index=index, columns=names)
+        return res
+
+    def getStudies(self, columns=None):
         """return all the studies that can be seen by the user
-        not all of these can be read (Samples and measurements can be private)"""
+        not all of these can be read (Samples and measurements can be private)
+        if columns is given the dataframe will contain only those columns"""
         res = self("getStudies")['studies']
-        if self.dataframe: 
-            res = self.to_dataframe(res)
+        if self.dataframe:
+            res = self._frame(res, columns)
         return res
 
     def getSubjectsForStudy(self, *study_token):
         """take all the subjects from a study given the study token
         if multiple token are given it will merge all the results"""
-        res = []
-        for token in study_token:
-            res += self('getSubjectsForStudy',{'studyToken':token})['subjects']
-        if self.dataframe: 
-            res = self.to_dataframe(res)
-        return res
+        return self._merge_records(self._multi('getSubjectsForStudy', 'studyToken', study_token, 'subjects'))
 
     def getAssaysForStudy(self, *study_token):
         """take all the assays from a study given the study token
         if multiple token are given it will merge all the results"""
-        res = []
-        for token in study_token:
-            res += self("getAssaysForStudy",{'studyToken':token})['assays']
-        if self.dataframe: 
-            res = self.to_dataframe(res)
-        return res
+        return self._merge_records(self._multi('getAssaysForStudy', 'studyToken', study_token, 'assays'))
 
     def getSamplesForAssay(self, *assay_token):
         """take all the samples from an assay given the assay token
         if multiple token are given it will merge all the results"""
-        res = []
-        for token in assay_token:
-            res += self("getSamplesForAssay",{'assayToken':token})["samples"]
-        if self.dataframe: 
-            res = self.to_dataframe(res)
-        return res
+        return self._merge_records(self._multi('getSamplesForAssay', 'assayToken', assay_token, 'samples'))
 
     def getMeasurementDataForAssay(self, *assay_token):
         """take all the measurements from an assay given the assay token
         if multiple token are given it will merge all the results"""
-        res = []
-        for token in assay_token:
-            res += self("getMeasurementDataForAssay",{'assayToken':token})["measurements"]
-        if self.dataframe:
-            #the measurement data has a format different from the others, so must
-            #be modified before converting it
-            temp = [ dict([('token',k)]+v.items()) for k,v in res.iteritems()]
-            res = self.to_dataframe(temp)
-        return res
-
+        return self._merge_measurements(self._multi('getMeasurementDataForAssay', 'assayToken', assay_token, 'measurements', stream=True))